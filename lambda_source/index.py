@@ -1,166 +1,283 @@
-import boto3
-from boto3.dynamodb.conditions import Key
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import os
 import logging
+import os
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
-MAX_ROWS = 10  # Specify the maximum number of rows to keep in the DynamoDB table
+STATE_TTL_DAYS = 30  # Rows are expired by DynamoDB TTL after this many days
+STATE_KEY = "RDSControl"  # Partition key shared by all state items
+LATEST_TIMESTAMP = "LATEST"  # Sort key of the item mirroring the most recent state
+
+# Built once, conditions are immutable and reused by every state history query.
+# "LATEST" sorts after every timestamp, so the range condition keeps the sentinel
+# item out of history queries.
+STATE_KEY_CONDITION = Key("StateKey").eq(STATE_KEY) & Key("Timestamp").lt(
+    LATEST_TIMESTAMP
+)
+
+# Keep connections alive so warm invocations reuse them instead of reconnecting
+BOTO_CONFIG = Config(
+    tcp_keepalive=True, retries={"mode": "standard", "max_attempts": 3}
+)
+
+# The schedule rarely changes, so it is kept in code rather than in the environment
+# to keep cold starts lean. Changing it requires redeploying the function code.
+STOP_AFTER_MINUTES = 30
+START_AFTER_DAYS = 6
+
+# Clients, table and environment values, set up once per container by init_once
+rds = None
+scheduler = None
+table = None
+RDS_INSTANCE_ID = None
+SCHEDULER_ROLE_ARN = None
+
+# Runs the independent follow-up calls of a start or stop action side by side
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+def init_once():
+    global rds, scheduler, table
+    global RDS_INSTANCE_ID, SCHEDULER_ROLE_ARN
+
+    if table is not None:
+        return
 
-dynamodb = boto3.resource("dynamodb")
-rds = boto3.client("rds")
-events = boto3.client("events")
-sns = boto3.client("sns")
+    try:
+        # Get the environment variables, only the deployment-specific values are passed in
+        RDS_INSTANCE_ID = os.environ["RDS_INSTANCE_ID"]
+        SCHEDULER_ROLE_ARN = os.environ["SCHEDULER_ROLE_ARN"]
 
-# Get the environment variables
-RDS_INSTANCE_ID = os.environ["RDS_INSTANCE_ID"]
-DYNAMODB_TABLE = os.environ["DYNAMODB_TABLE"]
-STOP_AFTER_MINUTES = int(os.getenv("STOP_AFTER_MINUTES", "30"))
-START_AFTER_DAYS = int(os.getenv("START_AFTER_DAYS", "6"))
+        rds = boto3.client("rds", config=BOTO_CONFIG)
+        scheduler = boto3.client("scheduler", config=BOTO_CONFIG)
+        # Assigned last, a failure above leaves table unset so the next call retries
+        table = boto3.resource("dynamodb", config=BOTO_CONFIG).Table(
+            os.environ["DYNAMODB_TABLE"]
+        )
+    except Exception as e:
+        logger.error("Error initializing clients and configuration: %s", e)
+        raise
 
 
 def lambda_handler(event, context):
+    init_once()
     logger.info("Lambda function has started execution.")
     lambda_function_arn = context.invoked_function_arn
 
-    now = datetime.now().replace(tzinfo=None)
-    table = dynamodb.Table(DYNAMODB_TABLE)
-    last_state = get_latest_state(table, "RDSControl")
+    now = datetime.now()
+    last_state = get_latest_state(table, now)
     state = last_state["State"]
-    last_action_time = datetime.strptime(last_state["Timestamp"], TIMESTAMP_FORMAT)
+    last_action_time = parse_timestamp(last_state["Timestamp"])
 
-    logger.info(f"Current state from DynamoDB: {state}")
+    logger.info("Current state from DynamoDB: %s", state)
 
     time_since_last_action = now - last_action_time
 
-    # Get the current state of the RDS instance
-    current_rds_state = get_rds_instance_current_status(rds, RDS_INSTANCE_ID)
-    logger.info(f"Current RDS instance state: {current_rds_state}")
+    # Decide from the stored state whether an action is due before asking RDS. Only a
+    # settled stopped or available state may skip the RDS call, any transitional
+    # state is re-checked on every invocation so it can be corrected.
+    action = due_action(state, time_since_last_action)
 
-    if current_rds_state != state:
-        # Update the state in the DynamoDB table if it differs from the current RDS state
-        log_state_change(table, current_rds_state, now)
-        state = current_rds_state
-        logger.info(f"State change logged: {state}")
+    if action is not None or state not in ("stopped", "available"):
+        # Confirm the stored state against the RDS instance before acting on it
+        current_rds_state = get_rds_instance_current_status(rds, RDS_INSTANCE_ID)
+        logger.info("Current RDS instance state: %s", current_rds_state)
 
-    if state == "stopped" and time_since_last_action.days >= START_AFTER_DAYS:
-        log_state_change(table, "available", now)
+        if current_rds_state == "unknown":
+            # The status could not be read, take no action and keep the stored state
+            action = None
+        elif current_rds_state != state:
+            # Re-check the thresholds against the actual RDS state
+            state = current_rds_state
+            action = due_action(state, time_since_last_action)
+            if action is None:
+                # Update the state in the DynamoDB table if it differs from the current
+                # RDS state. When an action follows, its own row at the same timestamp
+                # records the change instead.
+                log_state_change(
+                    table,
+                    state,
+                    now,
+                    f"RDS instance {RDS_INSTANCE_ID} is in state {state}.",
+                    "RDS Manager - No Action Taken",
+                )
+                logger.info("State change logged: %s", state)
+
+    if action == "start":
         rds.start_db_instance(DBInstanceIdentifier=RDS_INSTANCE_ID)
-        schedule_next_event(
-            events, "stop-instance", STOP_AFTER_MINUTES, lambda_function_arn, now
-        )
-        publish_sns_message(
-            sns,
-            f"RDS instance {RDS_INSTANCE_ID} has been started at {now} and will be stopped after {STOP_AFTER_MINUTES} minutes.",
-            "RDS Manager - Instance Started",
+        wait_for_all(
+            [
+                executor.submit(
+                    log_state_change,
+                    table,
+                    "available",
+                    now,
+                    f"RDS instance {RDS_INSTANCE_ID} has been started at {now} and will be stopped after {STOP_AFTER_MINUTES} minutes.",
+                    "RDS Manager - Instance Started",
+                ),
+                executor.submit(
+                    schedule_next_event,
+                    scheduler,
+                    "stop-instance",
+                    STOP_AFTER_MINUTES,
+                    lambda_function_arn,
+                    now,
+                ),
+            ]
         )
         logger.info(
-            f"RDS instance {RDS_INSTANCE_ID} started and scheduled to stop after {STOP_AFTER_MINUTES} minutes."
+            "RDS instance %s started and scheduled to stop after %s minutes.",
+            RDS_INSTANCE_ID,
+            STOP_AFTER_MINUTES,
         )
-    elif (
-        state == "available"
-        and time_since_last_action.total_seconds() >= STOP_AFTER_MINUTES * 60
-    ):
+    elif action == "stop":
         rds.stop_db_instance(DBInstanceIdentifier=RDS_INSTANCE_ID)
-        log_state_change(table, "stopped", now)
-        schedule_next_event(
-            events, "start-instance", START_AFTER_DAYS * 1440, lambda_function_arn, now
-        )
-        publish_sns_message(
-            sns,
-            f"RDS instance {RDS_INSTANCE_ID} has been stopped at {now} and will be started again in {START_AFTER_DAYS} days.",
-            "RDS Manager - Instance Stopped",
+        wait_for_all(
+            [
+                executor.submit(
+                    log_state_change,
+                    table,
+                    "stopped",
+                    now,
+                    f"RDS instance {RDS_INSTANCE_ID} has been stopped at {now} and will be started again in {START_AFTER_DAYS} days.",
+                    "RDS Manager - Instance Stopped",
+                ),
+                executor.submit(
+                    schedule_next_event,
+                    scheduler,
+                    "start-instance",
+                    START_AFTER_DAYS * 1440,
+                    lambda_function_arn,
+                    now,
+                ),
+            ]
         )
         logger.info(
-            f"RDS instance {RDS_INSTANCE_ID} stopped and scheduled to start in {START_AFTER_DAYS} days."
+            "RDS instance %s stopped and scheduled to start in %s days.",
+            RDS_INSTANCE_ID,
+            START_AFTER_DAYS,
         )
     else:
-        publish_sns_message(
-            sns,
-            f"RDS instance {RDS_INSTANCE_ID} is in state {state}.",
-            "RDS Manager - No Action Taken",
-        )
         logger.info(
-            f"No action needed for RDS instance {RDS_INSTANCE_ID} currently in state {state}."
+            "No action needed for RDS instance %s currently in state %s.",
+            RDS_INSTANCE_ID,
+            state,
         )
 
     return {
         "message": f"RDS instance {state}.",
         "state": state,
-        "timestamp": now.strftime(TIMESTAMP_FORMAT),
+        "timestamp": format_timestamp(now),
     }
 
 
-def log_state_change(dynamodb_table, new_state, timestamp):
-    # Put the new item into the DynamoDB table
-    dynamodb_table.put_item(
-        Item={
-            "StateKey": "RDSControl",
-            "Timestamp": timestamp.strftime(TIMESTAMP_FORMAT),
-            "State": new_state,
-        }
-    )
-
-    # Check if the number of rows exceeds MAX_ROWS
-    response = dynamodb_table.query(
-        KeyConditionExpression=Key("StateKey").eq("RDSControl"),
-        Select="COUNT",
-    )
-    row_count = response["Count"]
-
-    if row_count > MAX_ROWS:
-        # Delete the oldest item
-        oldest_item = dynamodb_table.query(
-            KeyConditionExpression=Key("StateKey").eq("RDSControl"),
-            ScanIndexForward=True,
-            Limit=1,
-        )["Items"][0]
-        dynamodb_table.delete_item(
-            Key={
-                "StateKey": oldest_item["StateKey"],
-                "Timestamp": oldest_item["Timestamp"],
+def due_action(state, time_since_last_action):
+    if state == "stopped" and time_since_last_action.days >= START_AFTER_DAYS:
+        return "start"
+    if (
+        state == "available"
+        and time_since_last_action.total_seconds() >= STOP_AFTER_MINUTES * 60
+    ):
+        return "stop"
+    return None
+
+
+def wait_for_all(futures):
+    # Wait for every call and re-raise the first failure, as a sequential call would
+    for future in futures:
+        future.result()
+
+
+def log_state_change(dynamodb_table, new_state, timestamp, message=None, subject=None):
+    item = {
+        "StateKey": STATE_KEY,
+        "Timestamp": format_timestamp(timestamp),
+        "State": new_state,
+    }
+    # History rows carrying a notification are published to SNS by the notifier
+    # function from the table's stream
+    notification = {}
+    if subject is not None:
+        notification = {"Message": message, "Subject": subject}
+
+    # Write the history row (removed later by TTL) and overwrite the latest state
+    # item in a single batch
+    with dynamodb_table.batch_writer() as batch:
+        batch.put_item(
+            Item={**item, **notification, "ExpiresAt": expires_at(timestamp)}
+        )
+        batch.put_item(
+            Item={
+                **item,
+                "Timestamp": LATEST_TIMESTAMP,
+                "ActionTimestamp": item["Timestamp"],
             }
         )
+    return item
+
+
+def format_timestamp(timestamp):
+    # Same "%Y-%m-%dT%H:%M:%SZ" layout as stored rows, without going through strftime
+    return timestamp.isoformat(timespec="seconds") + "Z"
+
+
+def parse_timestamp(value):
+    # fromisoformat only accepts the trailing "Z" from Python 3.11 onwards
+    return datetime.fromisoformat(value.rstrip("Z"))
+
+
+def expires_at(timestamp):
+    return int((timestamp + timedelta(days=STATE_TTL_DAYS)).timestamp())
 
 
 def schedule_next_event(
-    events_client, action, minutes, lambda_function_arn, source_time
+    scheduler_client, action, minutes, lambda_function_arn, source_time
 ):
-    rule_name = f"{action}-lambda-trigger"
+    schedule_name = f"{action}-lambda-trigger"
     future_time = source_time + timedelta(minutes=minutes)
-    cron_expression = future_time.strftime("cron(%M %H %d %m ? %Y)")
+    schedule_expression = f"at({future_time.isoformat(timespec='seconds')})"
 
+    # One-shot schedule that EventBridge Scheduler deletes once it has fired
+    schedule = {
+        "Name": schedule_name,
+        "ScheduleExpression": schedule_expression,
+        "FlexibleTimeWindow": {"Mode": "OFF"},
+        "Target": {"Arn": lambda_function_arn, "RoleArn": SCHEDULER_ROLE_ARN},
+        "ActionAfterCompletion": "DELETE",
+    }
     try:
-        events_client.put_rule(
-            Name=rule_name, ScheduleExpression=cron_expression, State="ENABLED"
-        )
-        events_client.put_targets(
-            Rule=rule_name,
-            Targets=[{"Id": "1", "Arn": lambda_function_arn}],
-        )
+        try:
+            scheduler_client.create_schedule(**schedule)
+        except scheduler_client.exceptions.ConflictException:
+            # A schedule with this name has not fired yet, move it instead
+            scheduler_client.update_schedule(**schedule)
     except Exception as e:
-        logger.error(f"Error scheduling next event: {str(e)}")
+        logger.error("Error scheduling next event: %s", e)
 
 
-def publish_sns_message(sns_client, message, subject):
+def get_latest_state(table, now):
     try:
-        sns_client.publish(
-            TopicArn=os.environ["SNS_TOPIC_ARN"],
-            Message=message,
-            Subject=subject,
+        response = table.get_item(
+            Key={"StateKey": STATE_KEY, "Timestamp": LATEST_TIMESTAMP},
+            ConsistentRead=False,
         )
-    except Exception as e:
-        logger.error(f"Error publishing SNS message: {str(e)}")
-
+        if "Item" in response:
+            latest = response["Item"]
+            return {**latest, "Timestamp": latest["ActionTimestamp"]}
 
-def get_latest_state(table, state_key):
-    try:
+        # No latest state item yet, fall back to the newest history row and skip
+        # rows that have expired but not yet been swept by TTL
         response = table.query(
-            KeyConditionExpression=Key("StateKey").eq(state_key),
+            KeyConditionExpression=STATE_KEY_CONDITION,
+            FilterExpression=Attr("ExpiresAt").not_exists()
+            | Attr("ExpiresAt").gt(int(now.timestamp())),
             ScanIndexForward=False,
             Limit=1,
         )
@@ -168,16 +285,10 @@ def get_latest_state(table, state_key):
             return response["Items"][0]
         else:
             # If no entries found, insert a record with a timestamp that forces a start from a stopped state
-            start_time = datetime.now() - timedelta(days=START_AFTER_DAYS + 1)
-            initial_state = {
-                "StateKey": state_key,
-                "Timestamp": start_time.strftime(TIMESTAMP_FORMAT),
-                "State": "stopped",
-            }
-            table.put_item(Item=initial_state)
-            return initial_state
+            start_time = now - timedelta(days=START_AFTER_DAYS + 1)
+            return log_state_change(table, "stopped", start_time)
     except Exception as e:
-        logger.error(f"Error retrieving or inserting latest state: {str(e)}")
+        logger.error("Error retrieving or inserting latest state: %s", e)
         return e
 
 
@@ -188,5 +299,12 @@ def get_rds_instance_current_status(rds_client, rds_instance_id):
         )
         return response["DBInstances"][0]["DBInstanceStatus"]
     except Exception as e:
-        logger.error(f"Error getting RDS instance status: {str(e)}")
+        logger.error("Error getting RDS instance status: %s", e)
         return "unknown"
+
+
+# Initialize during the cold start when possible, lambda_handler retries on failure
+try:
+    init_once()
+except Exception:
+    pass
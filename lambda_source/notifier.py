@@ -0,0 +1,36 @@
+import logging
+import os
+
+import boto3
+from botocore.config import Config
+
+# Setup logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+sns = boto3.client(
+    "sns",
+    config=Config(tcp_keepalive=True, retries={"mode": "standard", "max_attempts": 3}),
+)
+
+SNS_TOPIC_ARN = os.environ["SNS_TOPIC_ARN"]
+
+
+def lambda_handler(event, context):
+    # Triggered by the state table's stream, publishes the notification carried by
+    # each newly inserted history row
+    for record in event["Records"]:
+        new_image = record["dynamodb"].get("NewImage", {})
+        if record["eventName"] != "INSERT" or "Subject" not in new_image:
+            continue
+
+        # A failed publish is logged and skipped so it does not block the shard
+        try:
+            sns.publish(
+                TopicArn=SNS_TOPIC_ARN,
+                Message=new_image["Message"]["S"],
+                Subject=new_image["Subject"]["S"],
+            )
+            logger.info("Notification published: %s", new_image["Subject"]["S"])
+        except Exception as e:
+            logger.error("Error publishing SNS message: %s", e)
@@ -27,6 +27,9 @@ resource "aws_dynamodb_table" "lambda_rds_state" {
   hash_key     = "StateKey"
   range_key    = "Timestamp"
 
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   attribute {
     name = "StateKey"
     type = "S"
@@ -37,6 +40,11 @@ resource "aws_dynamodb_table" "lambda_rds_state" {
     type = "S"
   }
 
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
   tags = merge(
     local.common_tags,
     {
@@ -152,12 +160,45 @@ resource "aws_iam_role_policy" "lambda_rds_policy" {
   })
 }
 
-resource "aws_lambda_permission" "lambda_cloudwatch_policy" {
-  statement_id  = "AllowExecutionFromCloudWatch"
-  action        = "lambda:InvokeFunction"
-  function_name = aws_lambda_function.rds_manager.function_name
-  principal     = "events.amazonaws.com"
-  source_arn    = "arn:aws:events:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:rule/*"
+resource "aws_iam_role" "scheduler_invoke_role" {
+  name = "rds_management_scheduler_role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "scheduler.amazonaws.com"
+        }
+        Condition = {
+          StringEquals = {
+            "aws:SourceAccount" = data.aws_caller_identity.current.account_id
+          }
+        }
+      },
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "scheduler_lambda_invoke" {
+  name = "SchedulerLambdaInvoke"
+  role = aws_iam_role.scheduler_invoke_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = "lambda:InvokeFunction"
+        Resource = [
+          aws_lambda_function.rds_manager.arn,
+          "${aws_lambda_function.rds_manager.arn}:*"
+        ]
+      },
+    ]
+  })
 }
 
 resource "aws_iam_role_policy" "lambda_sns_publish" {
@@ -188,13 +229,22 @@ resource "aws_iam_role_policy" "lambda_dynamodb_access" {
         Action = [
           "dynamodb:GetItem",
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:UpdateItem",
-          "dynamodb:DeleteItem",
-          "dynamodb:Scan",
           "dynamodb:Query"
         ],
         Resource = aws_dynamodb_table.lambda_rds_state.arn
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ],
+        Resource = aws_dynamodb_table.lambda_rds_state.stream_arn
+      },
     ]
   })
 }
@@ -211,8 +261,7 @@ resource "aws_lambda_function" "rds_manager" {
     aws_iam_role_policy.lambda_rds_policy,
     aws_iam_role_policy.lambda_sns_publish,
     aws_iam_role_policy.lambda_dynamodb_access,
-    aws_dynamodb_table.lambda_rds_state,
-    aws_sns_topic.lambda_notifications
+    aws_dynamodb_table.lambda_rds_state
   ]
   function_name = "RDSInstanceManager"
   handler       = "index.lambda_handler"
@@ -228,10 +277,8 @@ resource "aws_lambda_function" "rds_manager" {
   environment {
     variables = {
       DYNAMODB_TABLE     = aws_dynamodb_table.lambda_rds_state.name
-      SNS_TOPIC_ARN      = aws_sns_topic.lambda_notifications.arn
       RDS_INSTANCE_ID    = data.aws_ssm_parameter.rds_instance_name.value
-      STOP_AFTER_MINUTES = var.stop_after_minutes
-      START_AFTER_DAYS   = var.start_after_days
+      SCHEDULER_ROLE_ARN = aws_iam_role.scheduler_invoke_role.arn
     }
   }
 
@@ -243,8 +290,69 @@ resource "aws_lambda_function" "rds_manager" {
   )
 }
 
-resource "aws_iam_role_policy" "lambda_cloudwatch_policy" {
-  name = "LambdaCloudWatchPolicy"
+resource "aws_lambda_function" "rds_notifier" {
+  depends_on = [
+    aws_s3_bucket.lambda_code_bucket,
+    aws_iam_role.lambda_execution_role,
+    aws_iam_role_policy.lambda_sns_publish,
+    aws_sns_topic.lambda_notifications
+  ]
+  function_name = "RDSInstanceManagerNotifier"
+  handler       = "notifier.lambda_handler"
+  runtime       = "python3.10"
+
+  s3_bucket = aws_s3_bucket.lambda_code_bucket.id
+  s3_key    = "rds-manager.zip"
+
+  role             = aws_iam_role.lambda_execution_role.arn
+  timeout          = 30
+  source_code_hash = filebase64sha256(data.archive_file.lambda_zip.output_path)
+
+  environment {
+    variables = {
+      SNS_TOPIC_ARN = aws_sns_topic.lambda_notifications.arn
+    }
+  }
+
+  tags = merge(
+    local.common_tags,
+    {
+      Purpose = "Publish RDS Start/Stop Notifications"
+    }
+  )
+}
+
+resource "aws_lambda_event_source_mapping" "rds_notifier_stream" {
+  depends_on = [
+    aws_iam_role_policy.lambda_dynamodb_access
+  ]
+  event_source_arn  = aws_dynamodb_table.lambda_rds_state.stream_arn
+  function_name     = aws_lambda_function.rds_notifier.arn
+  starting_position = "LATEST"
+
+  # Bound replays of a failing batch so it cannot hold up the shard for the
+  # stream's full 24 hour retention
+  maximum_retry_attempts         = 2
+  maximum_record_age_in_seconds  = 3600
+  bisect_batch_on_function_error = true
+
+  # Only history rows written with a notification reach the notifier
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["INSERT"]
+        dynamodb = {
+          NewImage = {
+            Subject = { S = [{ exists = true }] }
+          }
+        }
+      })
+    }
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_scheduler_policy" {
+  name = "LambdaSchedulerPolicy"
   role = aws_iam_role.lambda_execution_role.id
 
   policy = jsonencode({
@@ -253,16 +361,15 @@ resource "aws_iam_role_policy" "lambda_cloudwatch_policy" {
       {
         Effect = "Allow"
         Action = [
-          "events:PutEvents",
-          "events:PutRule",
-          "events:PutTargets",
-          "events:DeleteRule",
-          "events:RemoveTargets",
-          "events:DescribeRule",
-          "events:ListRules",
-          "events:ListTargetsByRule",
+          "scheduler:CreateSchedule",
+          "scheduler:UpdateSchedule",
         ]
-        Resource = "*"
+        Resource = "arn:aws:scheduler:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:schedule/default/*"
+      },
+      {
+        Effect   = "Allow"
+        Action   = "iam:PassRole"
+        Resource = aws_iam_role.scheduler_invoke_role.arn
       }
     ]
   })
@@ -272,6 +379,7 @@ data "archive_file" "lambda_zip" {
   type        = "zip"
   source_dir  = "${path.module}/lambda_source/"
   output_path = "${path.module}/rds-manager.zip"
+  excludes    = ["**/__pycache__/**", "**/*.pyc"]
 }
 
 resource "aws_s3_object" "lambda_zip" {
@@ -298,3 +406,15 @@ resource "aws_cloudwatch_log_group" "lambda_log_group" {
     }
   )
 }
+
+resource "aws_cloudwatch_log_group" "notifier_log_group" {
+  name              = "/aws/lambda/${aws_lambda_function.rds_notifier.function_name}"
+  retention_in_days = 14
+
+  tags = merge(
+    local.common_tags,
+    {
+      Purpose = "Store Lambda Function Logs"
+    }
+  )
+}